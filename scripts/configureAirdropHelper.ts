@@ -1,42 +1,60 @@
 import { ethers } from "hardhat"
+import { ContractTransactionResponse } from "ethers"
 import fs from "fs"
 import { parse } from "csv-parse/sync"
 
 async function main() {
 	// Read and parse the CSV file
 	const fileContent = fs.readFileSync("airdrop_checked_merged.csv", "utf-8")
-	const records = parse(fileContent, {
-		columns: true,
+	// Parse rows as plain arrays and resolve the columns once from the header
+	const records: string[][] = parse(fileContent, {
+		bom: true,
 		skip_empty_lines: true,
 	})
+	if (records.length === 0) {
+		throw new Error("Airdrop CSV is empty: expected a header with user and amount columns")
+	}
+	const header = records[0].map(column => column.trim())
+	const userIndex = header.indexOf("user")
+	const amountIndex = header.indexOf("amount")
+	if (userIndex === -1 || amountIndex === -1) {
+		throw new Error(`Airdrop CSV header must contain user and amount columns, got: ${header.join(",")}`)
+	}
+
+	// Keep users and amounts as parallel arrays that can be sliced per batch
+	const users: string[] = []
+	const amounts: bigint[] = []
+	for (let r = 1; r < records.length; r++) {
+		users.push(records[r][userIndex])
+		amounts.push(ethers.parseUnits(records[r][amountIndex], 18))
+	}
 
 	let address = ""
-	let contract = await ethers.getContractAt("AirdropHelper", address)
+	const [owner] = await ethers.getSigners()
+	let contract = await ethers.getContractAt("AirdropHelper", address, owner)
+	// Read the nonce once and assign consecutive nonces locally, so sending a batch does not query it again
+	const baseNonce = await owner.getNonce("pending")
+	// Fetch EIP-1559 fees once and reuse them for every batch
+	const { maxFeePerGas, maxPriorityFeePerGas } = await ethers.provider.getFeeData()
 
 	// Start from index 2000
 	const startIndex = 2000
 	const batchSize = 1000
 
 	let total = 0n
+	const pending: { index: number; tx: ContractTransactionResponse }[] = []
+	let sendError: unknown
+	let sendErrorIndex = 0
 	// Process records in batches of 1000
-	for (let i = startIndex; i < records.length; i += batchSize) {
-		let airdropRecipients = []
-		let airdropAmounts = []
-
+	for (let i = startIndex; i < users.length; i += batchSize) {
 		// Get the current batch
-		const currentBatch = records.slice(i, i + batchSize)
-
-		// Process records in current batch
-		for (const record of currentBatch) {
-			airdropRecipients.push(record.user)
-			airdropAmounts.push(ethers.parseUnits(record.amount.toString(), 18))
-			total += ethers.parseUnits(record.amount.toString(), 18)
-		}
+		const airdropRecipients = users.slice(i, i + batchSize)
+		const airdropAmounts = amounts.slice(i, i + batchSize)
 
 		console.log(
-			`\nProcessing batch from index ${i} to ${i + currentBatch.length - 1}`,
+			`\nProcessing batch from index ${i} to ${i + airdropRecipients.length - 1}`,
 		)
-		console.log(`Number of recipients in this batch: ${currentBatch.length}`)
+		console.log(`Number of recipients in this batch: ${airdropRecipients.length}`)
 
 		try {
 			// Send the transaction
@@ -44,22 +62,59 @@ async function main() {
 			const tx = await contract.configureAirdrop(
 				airdropRecipients,
 				airdropAmounts,
+				{ maxFeePerGas, maxPriorityFeePerGas, nonce: baseNonce + pending.length },
 			)
-
-			// Wait for the transaction to be mined
-			console.log("Waiting for transaction to be mined...")
-			const receipt = await tx.wait()
-
-			console.log(`Transaction successful! Tx hash: ${receipt?.hash}`)
-
-			// Optional: Add some delay between batches to prevent rate limiting
-			await new Promise(resolve => setTimeout(resolve, 5000))
+			pending.push({ index: i, tx })
+			for (const amount of airdropAmounts) {
+				total += amount
+			}
 		} catch (error) {
 			console.error(`Error processing batch starting at index ${i}:`, error)
-			// You might want to throw the error here to stop the script
-			throw error
+			// Stop sending, but still report the batches that are already in flight
+			sendError = error
+			sendErrorIndex = i
+			break
 		}
 	}
+
+	// Batches are submitted back to back with consecutive nonces, so wait for all of them together
+	console.log(`\nWaiting for ${pending.length} transactions to be mined...`)
+	const results = await Promise.allSettled(pending.map(({ tx }) => tx.wait()))
+
+	let resumeIndex = startIndex
+	let failed = 0
+	let gap = false
+	results.forEach((result, k) => {
+		const { index } = pending[k]
+		const endIndex = Math.min(index + batchSize, users.length)
+		if (result.status === "fulfilled") {
+			console.log(`Batch ${index}-${endIndex - 1} successful! Tx hash: ${result.value?.hash}`)
+			if (failed === 0) {
+				resumeIndex = endIndex
+			} else {
+				gap = true
+			}
+		} else {
+			console.error(`Batch ${index}-${endIndex - 1} failed:`, result.reason)
+			failed++
+		}
+	})
+
+	console.log(`\nConfirmed batches: ${pending.length - failed}/${pending.length}`)
+	console.log(`Last contiguous confirmed index: ${resumeIndex - 1} (resume with startIndex = ${resumeIndex})`)
+	if (gap) {
+		console.error("Batches after a failed one were confirmed; the on-chain airdrop config has a gap and must be cleared before resuming")
+	}
+	if (sendError !== undefined) {
+		// The failed send may still have been broadcast, so the resume point above is only a lower bound
+		console.error(
+			`Sending the batch at index ${sendErrorIndex} failed and it may still land on-chain; check getAirdropConfig() before rerunning with startIndex = ${resumeIndex}`,
+		)
+		throw sendError
+	}
+	if (failed > 0) {
+		throw new Error(`${failed} airdrop batch(es) failed`)
+	}
 	console.log("Total Amount", total)
 }
 